@@ -1,3 +1,6 @@
+import kivywm
+kivywm.setup_env()
+
 from kivy.app import App
 from kivywm.uix.windowmanager import KivyWindowManager
 from kivy.uix.boxlayout import BoxLayout
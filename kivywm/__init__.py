@@ -0,0 +1,11 @@
+import os
+
+def setup_env():
+    ''' Configure the environment for running under kivywm
+
+    Call this before the Kivy app creates its window, e.g. at the top of
+    ``main.py``. It isn't done on import, so that importing kivywm has no
+    side effects, and setting it once the manager connects is too late for
+    SDL to pick it up.
+    '''
+    os.environ['SDL_VIDEO_X11_LEGACY_FULLSCREEN'] = '0'
@@ -1,6 +1 @@
-from kivywm.graphics.extensions import egl_init
-
-egl_init()
-
 GL_TEXTURE_2D = 0x0DE1
-
@@ -3,6 +3,7 @@ cdef extern from "graphics.h":
 
 cdef EGL_Context g_egl
 cdef EGL_Context *egl = &g_egl
+cdef bint egl_initialized = False
 
 cdef EGL_Context *egl_get_context():
     return egl
@@ -12,6 +13,26 @@ cdef void egl_set_context(EGL_Context *ctx):
     egl = ctx
 
 cpdef void egl_init() except *:
+    ''' Resolve the EGL entry points, on first use rather than at import so
+    that the package can be imported without a display or GL context.
+    '''
+    global egl_initialized
+    if egl_initialized:
+        return
+
     egl.eglCreateImageKHR = <PFNEGLCREATEIMAGEKHRPROC>eglGetProcAddress("eglCreateImageKHR")
     egl.eglDestroyImageKHR = <PFNEGLDESTROYIMAGEKHRPROC>eglGetProcAddress("eglDestroyImageKHR")
     egl.glEGLImageTargetTexture2DOES = <PFNGLEGLIMAGETARGETTEXTURE2DOESPROC>eglGetProcAddress("glEGLImageTargetTexture2DOES")
+
+    missing = []
+    if egl.eglCreateImageKHR == NULL:
+        missing.append('eglCreateImageKHR')
+    if egl.eglDestroyImageKHR == NULL:
+        missing.append('eglDestroyImageKHR')
+    if egl.glEGLImageTargetTexture2DOES == NULL:
+        missing.append('glEGLImageTargetTexture2DOES')
+
+    if missing:
+        raise RuntimeError('EGL: required functions are unavailable: {}'.format(', '.join(missing)))
+
+    egl_initialized = True
@@ -1,14 +1,17 @@
 from kivy.graphics.texture cimport Texture as KivyTexture
 from kivywm.graphics.extensions cimport *
-from kivywm.graphics.tfp cimport bindTexImage
+from kivywm.graphics.tfp cimport bindTexImage, releaseTexImage
 
 def texture_create_from_pixmap(pixmap, size):
+    egl_init()
+
     colorfmt = 'rgba'
     cdef Texture texture = Texture(size[0], size[1], GL_TEXTURE_2D,
           colorfmt=colorfmt, bufferfmt='ubyte', mipmap=0,
           callback=None, icolorfmt=colorfmt)
 
     texture.bind_pixmap(pixmap)
+    texture.flip_vertical()
     texture.set_min_filter('linear')
     texture.set_mag_filter('linear')
     return texture
@@ -23,6 +26,15 @@ cdef class Texture(KivyTexture):
         self._image = NULL
 
     def bind_pixmap(self, pixmap):
+        ''' Bind `pixmap` as the texture's image. The texture can be rebound
+        to a new pixmap of the same size, keeping its tex coords and filters.
+        '''
         self.bind()
         bindTexImage(pixmap)
-        self.flip_vertical()
+
+    def release_pixmap(self):
+        ''' Drop the image of the bound pixmap, keeping the texture object so
+        that it can be bound to another pixmap of the same size.
+        '''
+        self.bind()
+        releaseTexImage()
@@ -2,3 +2,4 @@ from kivywm.graphics.extensions cimport *
 from kivy.core.window.window_info cimport *
 
 cdef EGLImageKHR bindTexImage(Pixmap pixmap) nogil
+cdef void releaseTexImage() nogil
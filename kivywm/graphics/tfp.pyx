@@ -59,3 +59,10 @@ cdef EGLImageKHR bindTexImage(Pixmap pixmap) nogil:
     egl.glEGLImageTargetTexture2DOES(GL_TEXTURE_2D, <GLeglImageOES>image)
     if image != <EGLImageKHR>EGL_NO_IMAGE_KHR:
         egl.eglDestroyImageKHR(egl_display, image)
+
+cdef void releaseTexImage() nogil:
+    ''' Replace the bound texture's image with empty storage, so that it no
+    longer holds on to the buffer of the pixmap it was bound to.
+    '''
+    cgl.glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA, 0, 0, 0, GL_RGBA,
+                     GL_UNSIGNED_BYTE, NULL)
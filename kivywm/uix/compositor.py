@@ -0,0 +1,175 @@
+'''
+Compositor
+==========
+
+The window compositor draws every managed :class:`XWindow` from a single
+render context and updates them all from one per-frame callback, instead of
+each window pushing its own render context and scheduling its own redraw.
+Assign an instance to :attr:`KivyWindowManager.compositor` before windows are
+created, and add it to the widget tree above the layout holding the windows.
+
+Each window is still laid out as a regular widget; only its drawing is moved
+into the compositor. Every frame, the compositor places each window's
+rectangle at the window's position in compositor coordinates, so moving an
+ancestor layout moves the window too. Windows are drawn in widget tree order,
+and only while they are active and attached to the same Kivy window as the
+compositor. The draw order is worked out again only when a window is
+activated, deactivated or reparented, or when the children of one of its
+ancestors change, so a frame costs one position check per window.
+
+.. note::
+
+    Each X window is backed by its own GL texture, so this still issues one
+    texture bind and one draw call per window. What is shared is the render
+    context, its state, and the per-frame update, which saves one context
+    push and one clock event per window.
+
+'''
+
+from kivy.clock import Clock
+from kivy.graphics import Color, Rectangle, RenderContext
+from kivy.logger import Logger
+from kivy.uix.widget import Widget
+
+import os
+
+class WindowCompositor(Widget):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+
+        self._rects = {}
+        self._order = []
+        self._order_dirty = True
+        # Ancestors of the windows, watched for changes to the draw order
+        self._ancestors = set()
+        self._redraw_event = None
+
+        refresh_hz = int(os.environ.get('KIVYWM_REFRESH_HZ', 60))
+        self.refresh_rate = 1 / refresh_hz if refresh_hz > 0 else 0
+        self.canvas = RenderContext(use_parent_projection=True,
+                                    use_parent_modelview=True,
+                                    use_parent_frag_modelview=True)
+
+        with self.canvas:
+            Color(1, 1, 1, 1)
+
+        self.bind(parent=self._invalidate_order)
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} windows: {len(self._rects)}>'
+
+    def add_window(self, window):
+        ''' Start drawing `window`, returns the rectangle it should texture
+        '''
+        rect = self._rects.get(window)
+        if rect:
+            return rect
+
+        rect = Rectangle(size=window.size)
+        self._rects[window] = rect
+
+        window.bind(active=self._on_window_active,
+                    parent=self._invalidate_order)
+        self._on_window_active(window, window.active)
+
+        Logger.trace(f'WindowMgr: {self}: added {window}')
+        return rect
+
+    def remove_window(self, window):
+        rect = self._rects.pop(window, None)
+        if not rect:
+            return
+
+        window.unbind(active=self._on_window_active,
+                      parent=self._invalidate_order)
+        if window in self._order:
+            self._order.remove(window)
+            self.canvas.remove(rect)
+        self._invalidate_order()
+
+        Logger.trace(f'WindowMgr: {self}: removed {window}')
+
+    def redraw(self, *args):
+        changed = False
+        if self._order_dirty:
+            self._order_dirty = False
+            order = self._visible_windows()
+            if order != self._order:
+                self._set_order(order)
+                changed = True
+
+        for window in self._order:
+            rect = self._rects[window]
+            pos = tuple(self.to_widget(*window.to_window(*window.pos)))
+            if tuple(rect.pos) != pos:
+                rect.pos = pos
+                changed = True
+
+            changed = window.needs_redraw() or changed
+
+        if changed:
+            self.canvas.ask_update()
+
+        if any(window.active for window in self._rects):
+            return True
+
+        self._redraw_event = None
+        return False
+
+    def _invalidate_order(self, *args):
+        self._order_dirty = True
+
+    def _on_window_active(self, window, active):
+        self._order_dirty = True
+        if active and not self._redraw_event:
+            self._redraw_event = Clock.schedule_interval(
+                self.redraw, self.refresh_rate)
+
+    def _visible_windows(self):
+        ancestors = set()
+        keyed = []
+        root = self.get_root_window()
+
+        for window in self._rects:
+            key = self._tree_key(window, root, ancestors)
+            if window.active and key is not None:
+                keyed.append((key, window))
+
+        self._watch_ancestors(ancestors)
+
+        keyed.sort(key=lambda item: item[0])
+        return [window for key, window in keyed]
+
+    def _tree_key(self, widget, root, ancestors):
+        # Path of draw indices from the root window, None if not attached.
+        # Children are drawn in reverse order of the children list.
+        key = []
+        parent = widget.parent
+        while parent is not None:
+            ancestors.add(parent)
+            children = parent.children
+            key.append(len(children) - 1 - children.index(widget))
+            widget, parent = parent, getattr(parent, 'parent', None)
+
+        if root is None or widget is not root:
+            return None
+
+        key.reverse()
+        return key
+
+    def _watch_ancestors(self, ancestors):
+        for widget in self._ancestors - ancestors:
+            widget.unbind(children=self._invalidate_order)
+        for widget in ancestors - self._ancestors:
+            widget.bind(children=self._invalidate_order)
+        self._ancestors = ancestors
+
+    def _set_order(self, order):
+        for window in self._order:
+            self.canvas.remove(self._rects[window])
+
+        for window in order:
+            self.canvas.add(self._rects[window])
+
+        self._order = order
+        self.canvas.ask_update()
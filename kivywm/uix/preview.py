@@ -0,0 +1,223 @@
+'''
+Window previews
+===============
+
+The preview exporter publishes downscaled frames of every active
+:class:`XWindow` into memory-mapped files, so that local processes can show
+previews without opening an X connection. Enable it with::
+
+    manager.export_previews = True
+
+Each window gets its own file, `kivywm-preview-<window id in hex>`, in a
+`kivywm-<uid>` directory under `KIVYWM_PREVIEW_DIR` (default `/dev/shm`).
+The directory is only accessible to the user running the manager, and the
+file is removed when the window goes away. A frame is written only after the
+window was damaged or its texture was rebuilt; windows without DAMAGE
+support are captured at every interval.
+
+Layout
+------
+
+All fields are little endian. The file starts with a header:
+
+====== ====== =================================================
+offset type   field
+====== ====== =================================================
+0      4s     magic, `KWMP`
+4      u32    version, 1
+8      u32    number of slots in the ring
+12     u32    size of each slot in bytes, including its header
+16     u32    window id
+20     u32    reserved
+24     u64    sequence number of the latest complete frame
+====== ====== =================================================
+
+It is followed by the slots, starting at offset 64. The frame with sequence
+number `n` is in slot `(n - 1) % slots`, which starts with its own header:
+
+====== ====== =================================================
+offset type   field
+====== ====== =================================================
+0      u64    sequence number, 0 while the slot is being written
+8      u32    window id
+12     i32    window x
+16     i32    window y
+20     u32    window width
+24     u32    window height
+28     u16    preview width
+30     u16    preview height
+====== ====== =================================================
+
+The preview pixels follow at offset 32 in the slot as RGBA, with rows from
+top to bottom. A reader should check that the slot's sequence number still
+matches after reading the pixels; if it doesn't, the slot was reused and the
+frame should be read again from the latest sequence number.
+
+'''
+
+from kivy.clock import Clock
+from kivy.graphics import ClearBuffers, ClearColor, Fbo, Rectangle
+from kivy.logger import Logger
+
+import mmap
+import os
+import stat
+import struct
+
+HEADER = struct.Struct('<4sIIIIIQ')
+HEADER_SIZE = 64
+SLOT_HEADER = struct.Struct('<QIiiIIHH')
+MAGIC = b'KWMP'
+VERSION = 1
+
+class PreviewRing(object):
+    ''' Ring buffer of preview frames for a single window, in a
+    memory-mapped file
+    '''
+
+    def __init__(self, path, window_id, max_size, slots=3):
+        self.path = path
+        self.window_id = window_id
+        self.slots = slots
+        self.slot_size = SLOT_HEADER.size + max_size[0] * max_size[1] * 4
+        self.sequence = 0
+
+        size = HEADER_SIZE + self.slots * self.slot_size
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC | os.O_NOFOLLOW,
+                     0o600)
+        try:
+            os.ftruncate(fd, size)
+            self._map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+        HEADER.pack_into(self._map, 0, MAGIC, VERSION, self.slots,
+                         self.slot_size, window_id, 0, 0)
+
+    def write(self, pixels, preview_size, geometry):
+        sequence = self.sequence + 1
+        offset = HEADER_SIZE + ((sequence - 1) % self.slots) * self.slot_size
+        x, y, width, height = geometry
+
+        # Invalidate the slot while it is being written
+        SLOT_HEADER.pack_into(self._map, offset, 0, self.window_id, x, y,
+                              width, height, *preview_size)
+        start = offset + SLOT_HEADER.size
+        self._map[start:start + len(pixels)] = pixels
+        SLOT_HEADER.pack_into(self._map, offset, sequence, self.window_id, x, y,
+                              width, height, *preview_size)
+
+        struct.pack_into('<Q', self._map, 24, sequence)
+        self.sequence = sequence
+
+    def close(self):
+        self._map.close()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+class PreviewExporter(object):
+    ''' Publishes previews of the manager's active windows
+
+    Previews are scaled down on the GPU to fit within :attr:`max_size`.
+    Windows are checked every :attr:`interval` seconds, and captured if they
+    changed since their last capture.
+    '''
+
+    max_size = (160, 120)
+    interval = 1 / 10
+
+    def __init__(self, manager, directory=None):
+        self.manager = manager
+
+        base = directory or os.environ.get('KIVYWM_PREVIEW_DIR', '/dev/shm')
+        self.directory = os.path.join(base, f'kivywm-{os.getuid()}')
+        self._make_directory(self.directory)
+
+        self._rings = {}
+        self._fbos = {}
+        self._last = {}
+        self._event = Clock.schedule_interval(self.capture, self.interval)
+
+    def stop(self):
+        self._event.cancel()
+        for id in list(self._rings):
+            self._release(id)
+
+    def capture(self, *args):
+        windows = {window.xid: window for window in self.manager.windows.windows('active')}
+
+        for id in list(self._rings):
+            if id not in windows:
+                self._release(id)
+
+        for id, window in windows.items():
+            texture = window.rect.texture
+            if texture is None:
+                continue
+
+            # Damage and texture rebuild counts at the last capture
+            state = (window.damage_count, window.texture_count)
+            if window.damage is not None and self._last.get(id) == state:
+                continue
+            self._last[id] = state
+
+            try:
+                self._capture(id, window, texture)
+            except OSError:
+                self._last.pop(id, None)
+                Logger.exception(f'WindowMgr: unable to export preview of {window}')
+
+    def _capture(self, id, window, texture):
+        preview_size = self._preview_size(texture.size)
+        fbo, rect = self._fbos.get(id, (None, None))
+        if fbo is None or tuple(fbo.size) != preview_size:
+            fbo = Fbo(size=preview_size)
+            with fbo:
+                ClearColor(0, 0, 0, 0)
+                ClearBuffers()
+                # Drawn upside down, so that rows are read top to bottom
+                rect = Rectangle(pos=(0, preview_size[1]),
+                                 size=(preview_size[0], -preview_size[1]))
+            self._fbos[id] = (fbo, rect)
+
+        rect.texture = texture
+        fbo.draw()
+        pixels = fbo.pixels
+
+        ring = self._rings.get(id)
+        if ring is None:
+            path = os.path.join(self.directory, f'kivywm-preview-{id:08x}')
+            ring = self._rings[id] = PreviewRing(path, id, self.max_size)
+
+        geometry = (round(window.x), round(window.y)) + tuple(texture.size)
+        ring.write(pixels, preview_size, geometry)
+
+    def _make_directory(self, path):
+        try:
+            os.mkdir(path, 0o700)
+        except FileExistsError:
+            pass
+
+        # Refuse a directory planted by another user, or a symlink to one
+        info = os.lstat(path)
+        if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or \
+                info.st_mode & 0o077:
+            raise PermissionError(f'WindowMgr: unsafe preview directory {path}')
+
+    def _preview_size(self, size):
+        width, height = size
+        if not width or not height:
+            return (1, 1)
+
+        scale = min(self.max_size[0] / width, self.max_size[1] / height, 1)
+        return (max(1, int(width * scale)), max(1, int(height * scale)))
+
+    def _release(self, id):
+        ring = self._rings.pop(id, None)
+        if ring:
+            ring.close()
+
+        self._fbos.pop(id, None)
+        self._last.pop(id, None)
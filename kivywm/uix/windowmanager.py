@@ -11,33 +11,52 @@ positioned according to kivy layouts.
 from kivy.graphics import Color, Rectangle, RenderContext
 from kivy.logger import Logger
 from kivy.event import EventDispatcher
-from kivy.properties import DictProperty, ObjectProperty, BooleanProperty, NumericProperty
+from kivy.properties import ObjectProperty, BooleanProperty, NumericProperty
 from kivy.uix.widget import Widget
 from kivy.uix.image import Image
-from kivy.clock import Clock
+from kivy.clock import Clock, mainthread
 
 from kivywm.graphics.texture import Texture
 
 import array
+import importlib
+import queue
 import weakref
 import select
 import subprocess
 import sys
 import os
-
-os.environ['SDL_VIDEO_X11_LEGACY_FULLSCREEN'] = '0'
-
-try:
-    import Xlib.display
-    import Xlib.error
-    import Xlib.protocol.event
-    import Xlib.threaded
-    import Xlib.X
-    import Xlib.Xatom
-    from Xlib.ext.composite import RedirectAutomatic
-    from Xlib.ext import randr, shape
-except ModuleNotFoundError:
-    Logger.warning('WindowMgr: Unable to import Xlib, please install it with "pip install python-xlib"')
+import threading
+
+# Xlib is imported by load_xlib() when a manager connects, so that importing
+# this module has no side effects and does not require a display.
+Xlib = None
+RedirectAutomatic = None
+damage = None
+randr = None
+shape = None
+
+def load_xlib():
+    global Xlib, RedirectAutomatic, damage, randr, shape
+
+    if Xlib is not None:
+        return
+
+    # Import into locals first, so that a failed import leaves nothing half
+    # loaded and the next call tries again
+    try:
+        xlib = importlib.import_module('Xlib')
+        for name in ('display', 'error', 'protocol.event', 'threaded', 'X', 'Xatom'):
+            importlib.import_module(f'Xlib.{name}')
+        from Xlib.ext.composite import RedirectAutomatic as redirect_automatic
+        from Xlib.ext import damage as damage_ext, randr as randr_ext, shape as shape_ext
+    except ImportError:
+        Logger.warning('WindowMgr: Unable to import Xlib, please install python-xlib 0.26 or newer with "pip install python-xlib"')
+        raise
+
+    Xlib = xlib
+    RedirectAutomatic = redirect_automatic
+    damage, randr, shape = damage_ext, randr_ext, shape_ext
 
 SUPPORTED_WINDOW_PROVIDERS = ['WindowX11', 'WindowSDL']
 
@@ -47,6 +66,7 @@ class XWindow(Widget):
         'on_window_resize',
         'on_window_unmap',
         'on_window_destroy',
+        'on_window_damage',
     ]
 
     active = BooleanProperty(False)
@@ -60,6 +80,20 @@ class XWindow(Widget):
 
         self.manager = manager
 
+        # Cached window state, filled in by the manager from prefetched data
+        # and events, so that rebuilding the texture needs no round trip.
+        self.geometry = None
+        self.wm_name = None
+        self.wm_class = None
+
+        # Damage object tracking the window's contents, None if DAMAGE is
+        # unsupported, in which case the window is redrawn every frame.
+        self.damage = None
+        self.damaged = True
+        self.damage_count = 0
+        # Number of times a pixmap was bound to the window's texture
+        self.texture_count = 0
+
         if window:
             self._window = window
         else:
@@ -71,14 +105,27 @@ class XWindow(Widget):
                 visual=Xlib.X.CopyFromParent,
             )
 
+        # The X id outlives _window, which is cleared on destroy
+        self.xid = self._window.id
+
+        if getattr(manager, 'damage_version', None):
+            self.damage = self.create_damage()
+
         refresh_hz = int(os.environ.get('KIVYWM_REFRESH_HZ', 60))
         self.refresh_rate = 1 / refresh_hz if refresh_hz > 0 else 0
-        self.canvas = RenderContext(use_parent_projection=True,
-                                    use_parent_modelview=True,
-                                    use_parent_frag_modelview=True)
 
-        with self.canvas:
-            self.rect = Rectangle(size=self.size)
+        # When the manager has a compositor, it draws this window alongside
+        # all the others, and redraws them once per frame.
+        self.compositor = getattr(manager, 'compositor', None)
+        if self.compositor is not None:
+            self.rect = self.compositor.add_window(self)
+        else:
+            self.canvas = RenderContext(use_parent_projection=True,
+                                        use_parent_modelview=True,
+                                        use_parent_frag_modelview=True)
+
+            with self.canvas:
+                self.rect = Rectangle(size=self.size)
 
     def __repr__(self):
         if hasattr(self, '_window') and self._window is not None:
@@ -86,20 +133,102 @@ class XWindow(Widget):
         else:
             return f'<{self.__class__.__name__} (No Window Bound)>'
 
+    def create_damage(self):
+        ''' Create a damage object reporting when the window's contents
+        change. Errors are ignored, the window may already be gone or be
+        InputOnly, in which case there is nothing to draw anyway.
+        '''
+        display = self._window.display
+        ec = Xlib.error.CatchError(Xlib.error.BadWindow, Xlib.error.BadMatch)
+
+        # damage_create() takes no error handler, so send the request here
+        damage_id = display.allocate_resource_id()
+        damage.DamageCreate(
+            display=display,
+            onerror=ec,
+            opcode=display.get_extension_major(damage.extname),
+            damage=damage_id,
+            drawable=self._window.id,
+            level=damage.DamageReportNonEmpty,
+        )
+        return damage_id
+
+    def set_window_info(self, info):
+        self.geometry = info.get('geometry')
+        self.wm_name = info.get('wm_name')
+        self.wm_class = info.get('wm_class')
+
+    def get_wm_name(self):
+        # Cleared by the manager when the title changes
+        if self.wm_name is None and self._window:
+            self.wm_name = self._window.get_wm_name()
+
+        return self.wm_name
+
     def focus(self):
-        self._win.set_input_focus(
-            revert_to=Xlib.X.RevertToParent, time=Xlib.X.CurrentTime)
+        if self._window:
+            self.manager.input_router.focus(self._window)
+
+    def to_root(self, x, y):
+        ''' Convert a point in parent coordinates to X root coordinates,
+        with the window placed as in :meth:`on_pos`.
+        '''
+        return (round(self.x) + round(x - self.x),
+                round(self.y) + round(self.top - y))
+
+    def _route_touch(self, touch, state=None):
+        router = getattr(self.manager, 'input_router', None)
+        if router is None or not self._window:
+            return False
+
+        width, height = self.geometry or (round(self.width), round(self.height))
+        rect = (round(self.x), round(self.y), width, height)
+        router.route_touch(touch, *self.to_root(*touch.pos), state=state, rect=rect)
+        return True
+
+    def on_touch_down(self, touch):
+        if not self.collide_point(*touch.pos):
+            return super().on_touch_down(touch)
+
+        if not self._route_touch(touch, 'down'):
+            return super().on_touch_down(touch)
+
+        self.focus()
+        touch.grab(self)
+        return True
+
+    def on_touch_move(self, touch):
+        if touch.grab_current is not self:
+            return super().on_touch_move(touch)
+
+        self._route_touch(touch)
+        return True
+
+    def on_touch_up(self, touch):
+        if touch.grab_current is not self:
+            return super().on_touch_up(touch)
+
+        self._route_touch(touch, 'up')
+        touch.ungrab(self)
+        return True
 
     def redraw(self, *args):
-        self.canvas.ask_update()
+        if self.needs_redraw():
+            self.canvas.ask_update()
         return self.active
 
+    def needs_redraw(self):
+        ''' Returns True if the window's contents changed since the last call
+        '''
+        damaged = self.damaged or self.damage is None
+        self.damaged = False
+        return damaged
+
     def on_invalidate_pixmap(self, *args):
         if not self.invalidate_pixmap or not self._window:
             return
 
         try:
-            self.release_texture()
             self.release_pixmap()
             self.create_pixmap()
             self.create_texture()
@@ -110,6 +239,8 @@ class XWindow(Widget):
 
     def on_active(self, *args):
         if self.active:
+            if self.compositor is not None:
+                return
             Clock.schedule_interval(self.redraw, self.refresh_rate)
         else:
             self.release_texture()
@@ -148,6 +279,9 @@ class XWindow(Widget):
         self.release_pixmap()
         self.canvas.clear()
 
+        if self.compositor is not None:
+            self.compositor.remove_window(self)
+
         window.destroy()
 
     @property
@@ -168,6 +302,8 @@ class XWindow(Widget):
         except AttributeError:
             return
 
+        # The server applies our configure before the pixmap is named
+        self.geometry = (round(self.width), round(self.height))
         self.invalidate_pixmap = True
 
     def on_pos(self, *args):
@@ -191,8 +327,14 @@ class XWindow(Widget):
         Logger.trace(f'WindowMgr: {self}: on_window_unmap')
         self.stop()
 
+    def on_window_damage(self):
+        self.damaged = True
+        self.damage_count += 1
+
     def on_window_destroy(self):
         Logger.trace(f'WindowMgr: {self}: on_window_destroy')
+        if self.compositor is not None:
+            self.compositor.remove_window(self)
 
     def create_pixmap(self):
         ec = Xlib.error.CatchError(Xlib.error.BadMatch)
@@ -215,16 +357,562 @@ class XWindow(Widget):
             return
 
         try:
-            geom = self._window.get_geometry()
-            self.texture = Texture.create_from_pixmap(self.pixmap.id, (geom.width, geom.height))
+            if self.geometry is None:
+                geom = self._window.get_geometry()
+                self.geometry = (geom.width, geom.height)
+
+            texture = self.texture
+            if texture is not None and tuple(texture.size) == tuple(self.geometry):
+                # Same size, rebind in place so the rectangle and its tex
+                # coords stay valid
+                texture.bind_pixmap(self.pixmap.id)
+                self.texture_count += 1
+                self.damaged = True
+                return
+
+            texture = self._acquire_texture(self.pixmap.id, self.geometry)
         except AttributeError:
             return
-        else:
-            self.rect.texture = self.texture
-            self.rect.size = self.texture.size
+
+        self._pool_texture(self.texture)
+        self.texture = texture
+        self.rect.texture = texture
+        self.rect.size = texture.size
+        self.texture_count += 1
+        self.damaged = True
 
     def release_texture(self):
-        self.texture = None
+        texture, self.texture = self.texture, None
+        self._pool_texture(texture)
+
+        # Pooled textures get rebound to other windows, stop drawing it
+        self.rect.texture = None
+        self.rect.size = (0, 0)
+
+    def _acquire_texture(self, pixmap, size):
+        pool = getattr(self.manager, 'texture_pool', None)
+        if pool is None:
+            return Texture.create_from_pixmap(pixmap, size)
+
+        return pool.acquire(pixmap, size)
+
+    def _pool_texture(self, texture):
+        pool = getattr(self.manager, 'texture_pool', None)
+        if pool is not None and texture is not None:
+            pool.release(texture)
+
+class TexturePool(object):
+    ''' Pool of pixmap textures, bucketed by size
+
+    Released textures let go of their pixmap's storage and are kept, up to
+    :attr:`max_per_size` per size and :attr:`max_textures` in total, to be
+    rebound to the next pixmap of the same size instead of allocating a new
+    GL texture. Once full, the least recently released texture is dropped.
+    :meth:`prune` drops the textures of sizes no window uses anymore.
+    '''
+
+    max_per_size = 2
+    max_textures = 16
+
+    def __init__(self):
+        self._buckets = {}
+        # Pooled textures, least recently released first
+        self._lru = []
+
+    def __len__(self):
+        return len(self._lru)
+
+    def acquire(self, pixmap, size):
+        bucket = self._buckets.get(tuple(size))
+        if not bucket:
+            return Texture.create_from_pixmap(pixmap, size)
+
+        texture = bucket.pop()
+        self._lru.remove(texture)
+        texture.bind_pixmap(pixmap)
+        return texture
+
+    def release(self, texture):
+        if any(texture is pooled for pooled in self._lru):
+            return
+
+        size = tuple(texture.size)
+        bucket = self._buckets.setdefault(size, [])
+        if len(bucket) >= self.max_per_size:
+            return
+
+        texture.release_pixmap()
+        bucket.append(texture)
+        self._lru.append(texture)
+
+        while len(self._lru) > self.max_textures:
+            self._drop(self._lru[0])
+
+    def prune(self, sizes):
+        ''' Drop the textures whose size is not in `sizes`
+        '''
+        sizes = {tuple(size) for size in sizes}
+        for size in list(self._buckets):
+            if size not in sizes:
+                for texture in self._buckets.pop(size):
+                    self._lru.remove(texture)
+
+    def clear(self):
+        self._buckets = {}
+        self._lru = []
+
+    def _drop(self, texture):
+        self._lru.remove(texture)
+        size = tuple(texture.size)
+        bucket = self._buckets[size]
+        bucket.remove(texture)
+        if not bucket:
+            del self._buckets[size]
+
+class WindowRegistry(object):
+    ''' Registry of the :class:`XWindow` objects owned by a manager
+
+    Windows are looked up by X id, and held until they are explicitly
+    removed. The registry also indexes windows by state:
+
+    - mapped: the X window is mapped
+    - active: the window is compositing its pixmap
+    - visible: the window is mapped, active and in the widget tree
+
+    Changes are batched, and `on_change` is called at most once per frame with
+    the set of X ids that were added, removed or changed state.
+    '''
+
+    states = ('mapped', 'active', 'visible')
+
+    def __init__(self, on_change=None):
+        self.on_change = on_change
+
+        self._windows = {}
+        self._index = {state: set() for state in self.states}
+        self._changed = set()
+        self._notify_trigger = Clock.create_trigger(self._notify)
+
+    def __contains__(self, id):
+        return id in self._windows
+
+    def __iter__(self):
+        return iter(list(self._windows.values()))
+
+    def __len__(self):
+        return len(self._windows)
+
+    def get(self, id):
+        return self._windows.get(id)
+
+    def add(self, window):
+        id = window.xid
+        if id in self._windows:
+            return
+
+        self._windows[id] = window
+        window.bind(active=self._on_window_update, parent=self._on_window_update)
+        self.update(window)
+        self._mark_changed(id)
+
+    def remove(self, id):
+        window = self._windows.pop(id, None)
+        if window is None:
+            return
+
+        window.unbind(active=self._on_window_update, parent=self._on_window_update)
+        for ids in self._index.values():
+            ids.discard(id)
+
+        self._mark_changed(id)
+        return window
+
+    def set_mapped(self, id, mapped):
+        window = self._windows.get(id)
+        if window is None:
+            return
+
+        self._set_state(id, 'mapped', mapped)
+        self.update(window)
+
+    def update(self, window):
+        id = window.xid
+        if id not in self._windows:
+            return
+
+        mapped = id in self._index['mapped']
+        self._set_state(id, 'active', window.active)
+        self._set_state(id, 'visible',
+                        mapped and window.active and window.parent is not None)
+
+    def ids(self, state):
+        return frozenset(self._index[state])
+
+    def windows(self, state):
+        return [self._windows[id] for id in self._index[state]]
+
+    def _on_window_update(self, window, *args):
+        self.update(window)
+
+    def _set_state(self, id, state, value):
+        ids = self._index[state]
+        if bool(value) == (id in ids):
+            return
+
+        if value:
+            ids.add(id)
+        else:
+            ids.discard(id)
+
+        self._mark_changed(id)
+
+    def _mark_changed(self, id):
+        self._changed.add(id)
+        self._notify_trigger()
+
+    def _notify(self, *args):
+        changed, self._changed = self._changed, set()
+        if changed and self.on_change:
+            self.on_change(changed)
+
+class RandrState(object):
+    ''' Cached RandR configuration of a screen
+
+    The state is fetched once with :meth:`refresh`, then kept current from the
+    RandR notify events so that handlers don't need a round trip per event.
+    CRTCs and outputs are stored as dicts keyed by their XIDs.
+    '''
+
+    def __init__(self):
+        self.size_id = None
+        self.rotation = None
+        self.config_timestamp = None
+        self.screen_size = (0, 0)
+        self.sizes = None
+        self.crtcs = {}
+        self.outputs = {}
+
+    def refresh(self, display, root):
+        screen_info = root.xrandr_get_screen_info()
+        self.size_id = screen_info.size_id
+        self.rotation = screen_info.rotation
+        self.config_timestamp = screen_info.config_timestamp
+        self.sizes = screen_info.sizes
+
+        try:
+            size = self.sizes[self.size_id]
+        except IndexError:
+            Logger.warning(f'WindowMgr: current screen size {self.size_id} is unavailable')
+        else:
+            self.screen_size = (size['width_in_pixels'], size['height_in_pixels'])
+
+        resources = root.xrandr_get_screen_resources()
+
+        self.crtcs = {}
+        for crtc in resources.crtcs:
+            info = display.xrandr_get_crtc_info(crtc, resources.config_timestamp)
+            self.crtcs[crtc] = {
+                'x': info.x, 'y': info.y,
+                'width': info.width, 'height': info.height,
+                'mode': info.mode, 'rotation': info.rotation,
+            }
+
+        self.outputs = {}
+        for output in resources.outputs:
+            info = display.xrandr_get_output_info(output, resources.config_timestamp)
+            self.outputs[output] = {
+                'name': info.name,
+                'crtc': info.crtc,
+                'mode': None,
+                'connection': info.connection,
+            }
+
+            crtc = self.crtcs.get(info.crtc)
+            if crtc:
+                self.outputs[output]['mode'] = crtc['mode']
+
+    def get_sizes(self, root):
+        # Sizes are dropped when outputs change, refetch them on demand
+        if self.sizes is None:
+            screen_info = root.xrandr_get_screen_info()
+            self.sizes = screen_info.sizes
+            self.config_timestamp = screen_info.config_timestamp
+
+        return self.sizes
+
+    def update_screen(self, event):
+        self.size_id = event.size_id
+        self.rotation = event.rotation
+        self.config_timestamp = event.config_timestamp
+        self.screen_size = (event.width_in_pixels, event.height_in_pixels)
+
+    def update_crtc(self, event):
+        self.crtcs[event.crtc] = {
+            'x': event.x, 'y': event.y,
+            'width': event.width, 'height': event.height,
+            'mode': event.mode, 'rotation': event.rotation,
+        }
+
+    def update_output(self, event):
+        output = self.outputs.setdefault(event.output, {'name': None})
+        output.update({
+            'crtc': event.crtc,
+            'mode': event.mode,
+            'connection': event.connection,
+        })
+
+        self.config_timestamp = event.config_timestamp
+        self.sizes = None
+
+    def output_geometry(self, output):
+        ''' Returns (x, y, width, height) of a connected output, or None
+        '''
+        info = self.outputs.get(output)
+        if not info or info.get('connection') != randr.Connected:
+            return
+
+        crtc = self.crtcs.get(info.get('crtc'))
+        if not crtc or not crtc['mode']:
+            return
+
+        return (crtc['x'], crtc['y'], crtc['width'], crtc['height'])
+
+    @property
+    def output_geometries(self):
+        geometries = {}
+        for output in self.outputs:
+            geometry = self.output_geometry(output)
+            if geometry:
+                geometries[output] = geometry
+
+        return geometries
+
+class InputRouter(object):
+    ''' Routes input to managed windows
+
+    Requests are queued and flushed together once per frame. Consecutive
+    motion events are coalesced, keeping only the latest one.
+
+    Keyboard input is routed by focus: the window being interacted with gets
+    the X input focus, and the server then delivers keystrokes to it
+    directly.
+
+    Kivy touches on an :class:`XWindow` are injected with XTest, so clients
+    see them as real events rather than synthetic ones. XTest events go to
+    the topmost window at the given point, which is normally the composite
+    overlay holding the Kivy window. For the duration of each gesture, the
+    target window's rectangle is therefore cut out of the overlay's input
+    shape, and the shape is restored when the gesture ends. This only works
+    for touches that Kivy doesn't receive through the X server, such as a
+    touchscreen read from /dev/input. Touches from :attr:`ignored_devices`
+    come from the X server itself, so they only move the focus; injecting
+    them would feed the events back to Kivy.
+    '''
+
+    ignored_devices = ('mouse',)
+
+    buttons = {
+        'left': 1,
+        'middle': 2,
+        'right': 3,
+        'scrolldown': 4,
+        'scrollup': 5,
+    }
+
+    def __init__(self, manager):
+        self.manager = manager
+
+        self._queue = []
+        self._motion = None
+        self._gestures = 0
+        self._flush_trigger = Clock.create_trigger(self.flush)
+
+        self.has_xtest = manager.display.has_extension('XTEST')
+        if not self.has_xtest:
+            Logger.warning('WindowMgr: XTEST is unsupported, touches will not be routed to windows')
+
+    def focus(self, window):
+        # Focus isn't cached, since the server can move it away at any time.
+        # Only the last focus change of a frame is sent.
+        if self._queue and self._queue[-1][0] == 'focus':
+            self._queue.pop()
+
+        self._push(('focus', window))
+
+    def forward(self, window, event):
+        ''' Re-send an intercepted X event to `window` '''
+        if event.type in (Xlib.X.KeyPress, Xlib.X.KeyRelease) and self.has_xtest:
+            # The window has the focus, replay the key as a real event. The
+            # manager holds no key grabs, so it isn't intercepted again.
+            self._push(('fake', event.type, event.detail, 0, 0))
+        elif event.type == Xlib.X.MotionNotify:
+            self._motion = ('send', window, event)
+            self._flush_trigger()
+        else:
+            self._push(('send', window, event))
+
+    def route_touch(self, touch, x, y, state=None, rect=None):
+        ''' Inject a touch at root coordinates (`x`, `y`), `state` is 'down',
+        'up' or None for motion. `rect` is the target window's root
+        rectangle, opened in the overlay's input shape for the gesture.
+        '''
+        if not self.has_xtest or touch.device in self.ignored_devices:
+            return
+
+        overlay = getattr(self.manager, 'overlay_win', None)
+        if state == 'down' and overlay is not None and rect:
+            self._push(('unshape', overlay, rect))
+            self._gestures += 1
+
+        self._motion = ('fake', Xlib.X.MotionNotify, 0, x, y)
+        if state is None:
+            self._flush_trigger()
+            return
+
+        button = self.buttons.get(getattr(touch, 'button', None), 1)
+        if button in (4, 5):
+            # Wheel events are a click
+            if state == 'down':
+                self._push(('fake', Xlib.X.ButtonPress, button, x, y))
+                self._push(('fake', Xlib.X.ButtonRelease, button, x, y))
+        elif state == 'down':
+            self._push(('fake', Xlib.X.ButtonPress, button, x, y))
+        else:
+            self._push(('fake', Xlib.X.ButtonRelease, button, x, y))
+
+        if state == 'up' and self._gestures:
+            self._gestures -= 1
+            if not self._gestures:
+                self._push(('reshape',))
+
+    def flush(self, *args):
+        self._push_motion()
+        requests, self._queue = self._queue, []
+        if not requests:
+            return
+
+        display = self.manager.display
+        ec = Xlib.error.CatchError(Xlib.error.BadWindow, Xlib.error.BadMatch)
+
+        for request in requests:
+            if request[0] == 'focus':
+                request[1].set_input_focus(
+                    revert_to=Xlib.X.RevertToParent,
+                    time=Xlib.X.CurrentTime,
+                    onerror=ec)
+            elif request[0] == 'send':
+                request[1].send_event(request[2], onerror=ec)
+            elif request[0] == 'fake':
+                event_type, detail, x, y = request[1:]
+                display.xtest_fake_input(event_type, detail=detail, x=x, y=y)
+            elif request[0] == 'unshape':
+                x, y, width, height = request[2]
+                request[1].shape_rectangles(
+                    shape.SO.Subtract, shape.SK.Input, Xlib.X.Unsorted, 0, 0,
+                    [{'x': x, 'y': y, 'width': width, 'height': height}])
+            elif request[0] == 'reshape':
+                self.manager.set_input_mask(self.manager.input_mask, sync=False)
+
+        display.flush()
+
+    def _push(self, request):
+        # Keep motion ordered relative to the other requests
+        self._push_motion()
+        self._queue.append(request)
+        self._flush_trigger()
+
+    def _push_motion(self):
+        if self._motion:
+            self._queue.append(self._motion)
+            self._motion = None
+
+class WindowPrefetcher(object):
+    ''' Fetches the attributes, geometry and properties of new windows on a
+    worker thread, over its own display connection
+
+    Results are passed to `callback(id, info)` on the main thread, where
+    `info` is None if the window was destroyed before it could be fetched,
+    and False if fetching it failed, in which case the caller should set the
+    window up itself. Once the connection fails, :attr:`running` is False and
+    every outstanding request is answered with False.
+    '''
+
+    def __init__(self, display_name, callback):
+        self.callback = callback
+        self.running = True
+
+        self._display = Xlib.display.Display(display_name)
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(
+            target=self._run, name='kivywm-prefetch', daemon=True)
+        self._thread.start()
+
+    def request(self, id):
+        self._queue.put(id)
+
+    def stop(self):
+        self._queue.put(None)
+
+    def _run(self):
+        try:
+            while True:
+                id = self._queue.get()
+                if id is None:
+                    break
+
+                try:
+                    info = self._fetch(id)
+                except Xlib.error.ConnectionClosedError:
+                    self._deliver(id, False)
+                    raise
+                except Exception:
+                    Logger.exception(f'WindowMgr: unable to prefetch window {hex(id)}')
+                    info = False
+
+                self._deliver(id, info)
+        except Exception:
+            Logger.exception('WindowMgr: window prefetcher stopped')
+        finally:
+            self.running = False
+            self._drain()
+
+            try:
+                self._display.close()
+            except Exception:
+                pass
+
+    def _drain(self):
+        while True:
+            try:
+                id = self._queue.get_nowait()
+            except queue.Empty:
+                return
+
+            if id is not None:
+                self._deliver(id, False)
+
+    def _fetch(self, id):
+        window = self._display.create_resource_object('window', id)
+
+        try:
+            attributes = window.get_attributes()
+            geometry = window.get_geometry()
+            wm_name = window.get_wm_name()
+            wm_class = window.get_wm_class()
+        except (Xlib.error.BadWindow, Xlib.error.BadDrawable):
+            return None
+
+        return {
+            'mapped': attributes.map_state == Xlib.X.IsViewable,
+            'override_redirect': attributes.override_redirect,
+            'geometry': (geometry.width, geometry.height),
+            'wm_name': wm_name,
+            'wm_class': wm_class,
+        }
+
+    @mainthread
+    def _deliver(self, id, info):
+        self.callback(id, info)
 
 class BaseWindowManager(EventDispatcher):
     event_mapping = {
@@ -244,19 +932,26 @@ class BaseWindowManager(EventDispatcher):
             'ReparentNotify': 'on_reparent_notify',
             'ConfigureNotify': 'on_configure_notify',
             'ConfigureRequest': 'on_configure_request',
+            'PropertyNotify': 'on_property_notify',
             # RandR Events
             'ScreenChangeNotify': 'on_screen_change_notify',
             'CrtcChangeNotify': 'on_crtc_change_notify',
             'OutputChangeNotify': 'on_output_change_notify',
             'OutputPropertyNotify': 'on_output_property_notify',
+            # DAMAGE Events
+            'DamageNotify': 'on_damage_notify',
         }
 
     display = None
     is_active = None
 
     app_window = ObjectProperty(None)
+    app_xwindow = None
+    input_router = None
+    randr_state = None
     xfixes_version = None
     shape_version = None
+    damage_version = None
 
     def __init__(self, *args, **kwargs):
         super(BaseWindowManager, self).__init__(*args, **kwargs)
@@ -264,9 +959,15 @@ class BaseWindowManager(EventDispatcher):
             for event in self.event_mapping.values()]
 
         self.connect()
+        self.input_router = InputRouter(self)
         self._set_app_window()
 
     def connect(self):
+        if 'SDL_VIDEO_X11_LEGACY_FULLSCREEN' not in os.environ:
+            Logger.warning('WindowMgr: call kivywm.setup_env() before the app '
+                           'window is created')
+        load_xlib()
+
         try:
             self.display = Xlib.display.Display()
             Logger.info(f'WindowMgr: Connected to display: {self.display.get_display_name()}')
@@ -320,6 +1021,14 @@ class BaseWindowManager(EventDispatcher):
             Logger.info(f'WindowMgr: Found SHAPE version '
                         f'{self.shape_version.major_version}.{self.shape_version.minor_version}')
 
+        # Every DAMAGE request fails until a version has been negotiated
+        if not self.display.has_extension('DAMAGE'):
+            Logger.warning(f'WindowMgr: DAMAGE is unsupported, windows will be redrawn every frame')
+        else:
+            self.damage_version = self.display.damage_query_version()
+            Logger.info(f'WindowMgr: Found DAMAGE version '
+                        f'{self.damage_version.major_version}.{self.damage_version.minor_version}')
+
         event_mask = Xlib.X.SubstructureNotifyMask \
                    | Xlib.X.SubstructureRedirectMask
 
@@ -340,8 +1049,17 @@ class BaseWindowManager(EventDispatcher):
             Logger.warning('WindowMgr: Unable to create window manager, another one is running')
             return
 
+        self.randr_state = RandrState()
+        self.randr_state.refresh(self.display, self.screen.root)
+
         app_window_info = self.app_window_info()
         app_window = self.display.create_resource_object('window', app_window_info.window)
+        self.app_xwindow = app_window
+
+        # Track the app window's real size, however it gets resized
+        app_window.change_attributes(event_mask=Xlib.X.StructureNotifyMask)
+        geom = app_window.get_geometry()
+        self.app_window_size = (geom.width, geom.height)
 
         net_supporting_wm_check = self.display.intern_atom('_NET_SUPPORTING_WM_CHECK')
         self.screen.root.change_property(net_supporting_wm_check, Xlib.Xatom.WINDOW, 32, array.array('I', [app_window.id]))
@@ -367,7 +1085,7 @@ class BaseWindowManager(EventDispatcher):
         self.screen.root.change_property(net_supported, Xlib.Xatom.ATOM, 32, supported_hints)
 
     def get_screen_sizes(self):
-        return self.screen.root.xrandr_get_screen_info().sizes
+        return self.randr_state.get_sizes(self.screen.root)
 
     def set_screen_size(self, size_id, rotation='preserve'):
         if rotation == 'normal':
@@ -381,25 +1099,27 @@ class BaseWindowManager(EventDispatcher):
         else:
             rotation = None
 
-        screen_info = self.screen.root.xrandr_get_screen_info()
+        sizes = self.get_screen_sizes()
         if not rotation:
-            rotation = screen_info.rotation
+            rotation = self.randr_state.rotation
 
         res = self.screen.root.xrandr_1_0set_screen_config(
             size_id=size_id,
             rotation=rotation,
-            config_timestamp=screen_info.config_timestamp,
+            config_timestamp=self.randr_state.config_timestamp,
         )
 
-        app_window_info = self.app_window_info()
-        app_window = self.display.create_resource_object(
-                'window', app_window_info.window)
-
-        size = screen_info.sizes[size_id]
+        size = sizes[size_id]
 
         # update the app window size immediately
-        app_window.configure(
-            width=size['width_in_pixels'], height=size['height_in_pixels'])
+        self.configure_app_window(size['width_in_pixels'], size['height_in_pixels'])
+
+    app_window_size = None
+    def configure_app_window(self, width, height):
+        if (width, height) == self.app_window_size:
+            return
+
+        self.app_xwindow.configure(width=width, height=height)
 
     def set_cursor(self, name='left_ptr'):
         p = subprocess.Popen(['xsetroot', '-cursor_name', name])
@@ -441,19 +1161,21 @@ class BaseWindowManager(EventDispatcher):
             pass
 
     def on_key_press(self, event):
-        event.window.send_event(event)
+        # Once focused, the server delivers keystrokes to the window directly
+        self.input_router.focus(event.window)
+        self.input_router.forward(event.window, event)
 
     def on_key_release(self, event):
-        event.window.send_event(event)
+        self.input_router.forward(event.window, event)
 
     def on_motion(self, event):
-        event.window.send_event(event)
+        self.input_router.forward(event.window, event)
 
     def on_button_press(self, event):
-        event.window.send_event(event)
+        self.input_router.forward(event.window, event)
 
     def on_button_release(self, event):
-        event.window.send_event(event)
+        self.input_router.forward(event.window, event)
 
     def on_client_message(self, event):
         pass
@@ -480,27 +1202,39 @@ class BaseWindowManager(EventDispatcher):
         pass
 
     def on_configure_notify(self, event):
-        pass
+        if self.app_xwindow and event.window.id == self.app_xwindow.id:
+            self.app_window_size = (event.width, event.height)
 
     def on_configure_request(self, event):
         pass
 
+    def on_property_notify(self, event):
+        pass
+
     # RandR Events
     def on_screen_change_notify(self, event):
-        pass
+        self.randr_state.update_screen(event)
 
     def on_crtc_change_notify(self, event):
-        pass
+        self.randr_state.update_crtc(event)
 
     def on_output_change_notify(self, event):
-        pass
+        self.randr_state.update_output(event)
 
     def on_output_property_notify(self, event):
         pass
 
+    # DAMAGE Events
+    def on_damage_notify(self, event):
+        pass
+
 class CompositingWindowManager(BaseWindowManager):
     required_extensions = ['Composite']
 
+    # Seconds without RandR events to wait for before resizing, so that a
+    # burst of them resizes the app window once
+    screen_change_delay = .1
+
     def check_extensions(self, extensions):
         for extension in extensions:
             if self.display.has_extension(extension):
@@ -510,6 +1244,8 @@ class CompositingWindowManager(BaseWindowManager):
 
     def setup_wm(self, *args):
         self.check_extensions(self.required_extensions)
+        self._resize_app_window_trigger = Clock.create_trigger(
+            self.resize_app_window, self.screen_change_delay)
 
         super(CompositingWindowManager, self).setup_wm()
 
@@ -524,12 +1260,14 @@ class CompositingWindowManager(BaseWindowManager):
 
         self.reparent_app_window()
 
-    def set_input_mask(self, mask=None):
+    input_mask = None
+    def set_input_mask(self, mask=None, sync=True):
         '''
         Mask is a tuple of (x, y, width, height) or None
 
         If mask is None, the input mask is cleared.
         '''
+        self.input_mask = mask
         if mask:
             x, y, width, height = [int(_) for _ in mask]
 
@@ -547,7 +1285,8 @@ class CompositingWindowManager(BaseWindowManager):
             self.overlay_win.shape_mask(shape.SO.Set, shape.SK.Input,
                                         0, 0, Xlib.X.NONE)
 
-        self.display.sync()
+        if sync:
+            self.display.sync()
 
     def reparent_app_window(self):
         window_info = self.app_window_info()
@@ -562,64 +1301,190 @@ class CompositingWindowManager(BaseWindowManager):
         kivy_win.map()
         self.display.sync()
 
+    def resize_app_window(self, *args):
+        width, height = self.randr_state.screen_size
+        if not width or not height:
+            Logger.warning('WindowMgr: screen size is unavailable')
+            return
+
+        Logger.debug(f'WindowMgr: resizing app window to {width}x{height}, '
+                     f'outputs: {self.randr_state.output_geometries}')
+        self.configure_app_window(width, height)
+
+    def _schedule_resize_app_window(self):
+        # Restart the delay on every event, a pending trigger isn't re-armed
+        self._resize_app_window_trigger.cancel()
+        self._resize_app_window_trigger()
+
     def on_screen_change_notify(self, event):
         super(CompositingWindowManager, self).on_screen_change_notify(event)
-        app_window_info = self.app_window_info()
-        app_window = self.display.create_resource_object(
-                'window', app_window_info.window)
+        self._schedule_resize_app_window()
 
-        screen_info = self.screen.root.xrandr_get_screen_info()
+    def on_crtc_change_notify(self, event):
+        super(CompositingWindowManager, self).on_crtc_change_notify(event)
+        self._schedule_resize_app_window()
 
-        try:
-            size = screen_info.sizes[screen_info.size_id]
-        except IndexError:
-            Logger.exception('Desired screen size is unavailable')
-        else:
-            app_window.configure(
-                width=size['width_in_pixels'], height=size['height_in_pixels'])
+    def on_output_change_notify(self, event):
+        super(CompositingWindowManager, self).on_output_change_notify(event)
+        self._schedule_resize_app_window()
 
 class KivyWindowManager(CompositingWindowManager):
-    __events__ = ('on_window_create',)
+    __events__ = ('on_window_create', 'on_windows_changed')
 
-    window_refs = DictProperty({})
+    compositor = ObjectProperty(None, allownone=True)
 
-    def stop(self):
-        for id, ref in self.window_refs.items():
-            window = ref()
-            if window:
-                window.active = False
+    # Publish window previews to shared memory, see kivywm.uix.preview
+    export_previews = BooleanProperty(False)
+    preview_exporter = None
+
+    # Fetch new windows' state on a worker thread before creating them
+    prefetch_windows = True
+
+    def __init__(self, *args, **kwargs):
+        self.windows = WindowRegistry(on_change=self._on_windows_changed)
+        self.texture_pool = TexturePool()
+        self._prefetcher = None
+        self._pending_windows = {}
+        super(KivyWindowManager, self).__init__(*args, **kwargs)
+
+    def setup_wm(self, *args):
+        super(KivyWindowManager, self).setup_wm()
+
+        self._name_atoms = (
+            Xlib.Xatom.WM_NAME,
+            self.display.intern_atom('_NET_WM_NAME'),
+        )
+
+        if self.is_active and self.prefetch_windows:
+            self._prefetcher = WindowPrefetcher(
+                self.display.get_display_name(), self._on_window_prefetched)
+
+    def stop(self, *args):
+        for window in self.windows:
+            window.active = False
+
+        if self._prefetcher:
+            self._prefetcher.stop()
+            self._prefetcher = None
 
-    def _add_child(self, window):
+        self.export_previews = False
+
+    def _set_app_window(self):
+        super(KivyWindowManager, self)._set_app_window()
+
+        from kivy.app import App
+        App.get_running_app().bind(on_stop=self.stop)
+
+    def _add_child(self, window, info=None):
         ''' Creates an XWindow object that can be retrieved and used as a widget by the main app
         '''
-        if window.id not in self.window_refs:
+        if window.id not in self.windows:
             window_widget = XWindow(self, window)
-            self.window_refs[window.id] = weakref.ref(window_widget)
+            if info:
+                window_widget.set_window_info(info)
+            self.windows.add(window_widget)
             self.dispatch('on_window_create', window_widget)
+            return window_widget
+
+    def _on_window_prefetched(self, id, info):
+        pending = self._pending_windows.pop(id, None)
+        if pending is None or info is None:
+            # Destroyed while it was being fetched
+            return
+
+        window = self.display.create_resource_object('window', id)
+
+        if info is False:
+            # Prefetching failed, set the window up here instead
+            try:
+                attributes = window.get_attributes()
+            except (Xlib.error.BadWindow, Xlib.error.BadDrawable):
+                return
+
+            info = {'mapped': attributes.map_state == Xlib.X.IsViewable}
+
+        # Events handled in the meantime are newer than the fetched state
+        info.update(pending)
+
+        window_widget = self._add_child(window, info)
+
+        if window_widget and info['mapped']:
+            self.windows.set_mapped(id, True)
+            window_widget.dispatch('on_window_map')
+
+    def on_export_previews(self, instance, value):
+        if value and not self.preview_exporter:
+            from kivywm.uix.preview import PreviewExporter
+            self.preview_exporter = PreviewExporter(self)
+        elif not value and self.preview_exporter:
+            self.preview_exporter.stop()
+            self.preview_exporter = None
+
+    @property
+    def window_refs(self):
+        ''' Read-only mapping of X id to a weakref of each window, kept for
+        compatibility. Use :attr:`windows` instead.
+        '''
+        return {window.xid: weakref.ref(window) for window in self.windows}
+
+    def _on_windows_changed(self, ids):
+        sizes = set()
+        for window in self.windows:
+            if window.geometry:
+                sizes.add(tuple(window.geometry))
+        self.texture_pool.prune(sizes)
+
+        self.dispatch('on_windows_changed', ids)
 
     def on_window_create(self, window):
         pass
 
+    def on_windows_changed(self, ids):
+        pass
+
     def get_window(self, name=None, id=None):
         if name:
-            for id, ref in self.window_refs.items():
-                window = ref()
-                if not window:
-                    continue
-
+            for window in self.windows:
                 if window.get_wm_name() == name:
                     return window
 
         if id:
-            window = self.window_refs.get(id)
-            if window:
-                return window()
+            return self.windows.get(id)
 
     def create_window(self):
         window = XWindow(self)
-        self.window_refs[window.id] = weakref.ref(window)
+        self.windows.add(window)
         return window
 
+    def on_property_notify(self, event):
+        if event.atom in self._name_atoms:
+            if event.window.id in self._pending_windows:
+                self._pending_windows[event.window.id]['wm_name'] = None
+
+            window = self.windows.get(event.window.id)
+            if window:
+                window.wm_name = None
+
+        elif event.atom == Xlib.Xatom.WM_CLASS:
+            if event.window.id in self._pending_windows:
+                self._pending_windows[event.window.id]['wm_class'] = None
+
+            window = self.windows.get(event.window.id)
+            if window:
+                window.wm_class = None
+
+        super(KivyWindowManager, self).on_property_notify(event)
+
+    def on_damage_notify(self, event):
+        # Acknowledge the damage so that the next change is reported
+        self.display.damage_subtract(event.damage)
+
+        window = self.windows.get(event.drawable.id)
+        if window:
+            window.dispatch('on_window_damage')
+
+        super(KivyWindowManager, self).on_damage_notify(event)
+
     def on_client_message(self, event):
         Logger.trace(f'WindowMgr: client message: {event}, atom: {self.display.get_atom_name(event.type)},\
                 client_type: {self.display.get_atom_name(event.client_type)}')
@@ -634,30 +1499,45 @@ class KivyWindowManager(CompositingWindowManager):
         if event.window == self.overlay_win:
             return
 
-        self._add_child(event.window)
+        # Watch for title changes, before the properties are first read
+        ec = Xlib.error.CatchError(Xlib.error.BadWindow)
+        event.window.change_attributes(
+            event_mask=Xlib.X.PropertyChangeMask, onerror=ec)
+
+        if self._prefetcher and self._prefetcher.running:
+            self._pending_windows[event.window.id] = {}
+            self._prefetcher.request(event.window.id)
+        else:
+            self._add_child(event.window)
 
         Logger.trace(f'WindowMgr: window created: {event}')
         super(KivyWindowManager, self).on_create_notify(event)
 
     def on_destroy_notify(self, event):
         Logger.trace(f'WindowMgr: window destroyed: {event}')
-        ref = self.window_refs.pop(event.window.id, None)
-        window = ref() if ref else None
+        self._pending_windows.pop(event.window.id, None)
+        window = self.windows.remove(event.window.id)
         if window:
             window.dispatch('on_window_destroy')
         super(KivyWindowManager, self).on_destroy_notify(event)
 
     def on_unmap_notify(self, event):
         Logger.trace(f'WindowMgr: window unmapped: {event}')
-        ref = self.window_refs.get(event.window.id)
-        window = ref() if ref else None
+        if event.window.id in self._pending_windows:
+            self._pending_windows[event.window.id]['mapped'] = False
+
+        self.windows.set_mapped(event.window.id, False)
+        window = self.windows.get(event.window.id)
         if window:
             window.dispatch('on_window_unmap')
         super(KivyWindowManager, self).on_unmap_notify(event)
 
     def on_map_notify(self, event):
-        ref = self.window_refs.get(event.window.id)
-        window = ref() if ref else None
+        if event.window.id in self._pending_windows:
+            self._pending_windows[event.window.id]['mapped'] = True
+
+        self.windows.set_mapped(event.window.id, True)
+        window = self.windows.get(event.window.id)
         if window:
             window.dispatch('on_window_map')
 
@@ -673,6 +1553,18 @@ class KivyWindowManager(CompositingWindowManager):
 
     def on_reparent_notify(self, event):
         Logger.trace(f'WindowMgr: window reparented: {event}')
+
+        # A window moved off the root no longer reports DestroyNotify to us,
+        # so let go of it now
+        if event.parent.id != self.screen.root.id:
+            self._pending_windows.pop(event.window.id, None)
+            window = self.windows.remove(event.window.id)
+            if window:
+                window.active = False
+                window.release_texture()
+                window.release_pixmap()
+                window.dispatch('on_window_destroy')
+
         super(KivyWindowManager, self).on_reparent_notify(event)
 
     def on_reparent_request(self, event):
@@ -680,10 +1572,14 @@ class KivyWindowManager(CompositingWindowManager):
         super(KivyWindowManager, self).on_reparent_request(event)
 
     def on_configure_notify(self, event):
-        # TODO: Check if the window was actually resized
-        ref = self.window_refs.get(event.window.id)
-        window = ref() if ref else None
-        if window:
+        geometry = (event.width, event.height)
+        if event.window.id in self._pending_windows:
+            self._pending_windows[event.window.id]['geometry'] = geometry
+
+        # Moves don't change the pixmap, only rebuild it on a resize
+        window = self.windows.get(event.window.id)
+        if window and window.geometry != geometry:
+            window.geometry = geometry
             window.dispatch('on_window_resize')
 
         Logger.trace(f'WindowMgr: window configured: {event}')